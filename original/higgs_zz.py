@@ -1,16 +1,33 @@
 # Import standard libraries.
+from collections.abc import Iterable, Iterator
+import concurrent.futures
+import os
+import queue
+import threading
 import time
 
 # Import external libraries.
 import awkward as ak
 import matplotlib.pyplot as plt
 from matplotlib.ticker import AutoMinorLocator
+import numba
 import numpy as np
+import pyarrow
+import pyarrow.parquet
 import uproot
-import vector
 
 # Import local modules.
 import infofile
+import kernels
+
+# Import the ahead-of-time compiled kernel, if it has been built (python kernels.py).
+# Otherwise, compile the kernel just-in-time.
+# The subsamples are already processed in parallel threads, so the kernel runs serially and 
+# releases the GIL (Numba's parallel threading layers are not safe to launch from many threads).
+try:
+    from atlas_kernels import filter_mass
+except ImportError:
+    filter_mass = numba.njit(nogil=True, fastmath=True, cache=True)(kernels.filter_mass)
 
 # Define energies.
 MEV = 0.001
@@ -20,7 +37,7 @@ GEV = 1.0
 LUMINOSITY = 10
 
 # Define the root path to the dataset.
-PATH = "https://atlas-opendata.web.cern.ch/Legacy13TeV/4lep/"
+PATH = "root://eospublic.cern.ch//eos/opendata/atlas/OutreachDatasets/2020-01-22/4lep/"
 
 # Define the samples dictionary for data indexing and identification.
 SAMPLES = {
@@ -54,6 +71,36 @@ WEIGHT_VARS = ["mcWeight", "scaleFactor_PILEUP", "scaleFactor_ELE", "scaleFactor
 # Create a variable to control the number of events processed.
 FRACTION = 1.0
 
+# Define the x-axis range and bin width of the histogram.
+X_MIN = 80 * GEV
+X_MAX = 250 * GEV
+BIN_WIDTH = 5 * GEV
+
+# Define the bin edges of the histogram.
+BIN_EDGES = np.arange(start=X_MIN, stop=(X_MAX+BIN_WIDTH), step=BIN_WIDTH)
+
+# Define the directory used to cache the valid events of each subsample.
+CACHE_DIR = ".cache"
+
+# Define the maximum number of subsamples processed concurrently.
+MAX_WORKERS = 8
+
+# Create a lock to stop the output of concurrent subsamples from interleaving.
+PRINT_LOCK = threading.Lock()
+
+# Create thread pools for decompressing and interpreting the ROOT file baskets.
+DECOMPRESSION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+INTERPRETATION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+# Define the number of batches read ahead of the batch being processed.
+PREFETCH_SIZE = 2
+
+# Create a marker for the end of a prefetched iterable.
+PREFETCH_END = object()
+
+# Define how often the prefetching thread checks whether the consumer has stopped (seconds).
+PREFETCH_TIMEOUT = 0.5
+
 
 def main():
     """
@@ -64,186 +111,401 @@ def main():
     # Define a dictionary to store the final processed data.
     processed_data = {}
 
-    # Loop over all the samples.
-    for sample in SAMPLES:
-        # Print the sample being processed.
-        print(f"Processing: {sample}")
-
-        # Define a list to hold the sample's processed data.
-        sample_processed_data = []
-
-        # Loop over subsample in the sample.
-        for subsample in SAMPLES[sample]["list"]:
-            # If the sample is measured data.
-            if sample == "data":
-                prefix = "Data/"
-            
-            # If the sample is Monte Carlo data.
-            else:
-                prefix = "MC/mc_" + str(infofile.infos[subsample]["DSID"]) + "."
+    # Process the subsamples concurrently, the reads are bound by network latency.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Submit every subsample in every sample for processing.
+        futures = {sample: [executor.submit(process_subsample, sample, subsample) 
+                            for subsample in SAMPLES[sample]["list"]] 
+                   for sample in SAMPLES}
 
-            # Create the path to the subsample.
-            path_subsample = PATH + prefix + subsample + ".4lep.root"
+        # Combine the histograms of each sample's subsamples.
+        for sample in SAMPLES:
+            results = [future.result() for future in futures[sample]]
+            processed_data[sample] = {key: np.sum([result[key] for result in results], axis=0) 
+                                      for key in results[0]}
 
-            # Start the clock.
-            start_time = time.time()
-            print(f"\t{subsample}:")
+    # Plot the processed data (saved as a png).
+    plot_data(processed_data)
 
-            # Open the subsample's file.
-            tree = uproot.open(path_subsample + ":mini")
 
-            # Create a list to store the valid events.
-            valid_events = []
+def process_subsample(sample: str, subsample: str) -> dict[str, np.ndarray]:
+    """
+    Processes the data of a single subsample for the Higgs to 4-Lepton decay 
+    process from the ATLAS Open Data project. The invariant mass of the valid 
+    events is histogrammed batch by batch, so only the histogram is kept in 
+    memory. The valid events are read from the local cache if the subsample 
+    has been processed before.
+
+    Parameters
+    ----------
+    sample : str
+        The sample that the subsample belongs to.
+
+    subsample : str
+        The subsample (decay process) being processed.
+
+    Returns
+    -------
+    processed_data : dict[str, numpy.ndarray]
+        A dictionary containing the (weighted) number of valid events in each 
+        histogram bin ("counts") and the sum of the squared weights in each 
+        histogram bin ("sumw2").
+    """
+
+    # Create the path to the subsample's cache file.
+    cache_path = os.path.join(CACHE_DIR, f"{subsample}_{FRACTION}.parquet")
 
-            # Filter the valid events in the data.
-            for data in tree.iterate(DATA_VARS + WEIGHT_VARS, library="ak", step_size=1000000,
-                                     entry_stop=(tree.num_entries * FRACTION)): 
-                # Store the number of events before reduction in the data.
-                num_events_before = len(data)
+    # If the subsample has been processed before, read the valid events from the cache.
+    if os.path.exists(cache_path):
+        batches = read_cache(sample, subsample, cache_path)
 
-                # Keep the events with valid lepton type.
-                lepton_types = data["lep_type"]
-                data = data[valid_lepton_type(lepton_types)]
+    # Otherwise, read the valid events from the subsample's file (filling the cache).
+    else:
+        batches = read_subsample(sample, subsample, cache_path)
 
-                # Keep the events with valid lepton charge.
-                lepton_charges = data["lep_charge"]
-                data = data[valid_lepton_charge(lepton_charges)]
+    # Create arrays to accumulate the histogram of the valid events.
+    num_bins = len(BIN_EDGES) - 1
+    counts = np.zeros(num_bins)
+    sumw2 = np.zeros(num_bins)
 
-                # Calculate the invariant mass of the remaining events.
-                data["mass"] = calc_invariant_mass(data["lep_pt"], data["lep_eta"], data["lep_phi"], data["lep_E"])
+    # Add each batch of valid events to the histogram.
+    for invariant_mass, mc_weight in batches:
+        # Find the bin of each event once, for both the counts and the squared weights.
+        # Include events on the last bin edge in the last bin (as numpy.histogram does).
+        bin_indices = np.searchsorted(BIN_EDGES, invariant_mass, side="right") - 1
+        bin_indices[invariant_mass == BIN_EDGES[-1]] = num_bins - 1
 
-                # If the data is from Monte Carlo simulation, perform Monte Carlo specific processing.
-                if "data" not in subsample:
-                    # Calculate the Monte Carlo weights of the events.
-                    # Calculate the final number of events.
-                    data["mc_weight"] = calc_mc_weight(data, subsample, WEIGHT_VARS)
-                    num_events_after = sum(data["mc_weight"])
+        # Drop the events outside of the histogram range.
+        in_range = (bin_indices >= 0) & (bin_indices < num_bins)
+        bin_indices = bin_indices[in_range]
 
-                # Otherwise, proceed as normal.
-                else:
-                    # Calculate the final number of events.
-                    num_events_after = len(data)
+        # If the data is measured data, it is unweighted.
+        if mc_weight is None:
+            binned = np.bincount(bin_indices, minlength=num_bins)
+            counts += binned
+            sumw2 += binned
 
-                # Stop the timer.
-                runtime = time.time() - start_time
-                print(f"\t Events Before: {num_events_before}" + 
+        # Otherwise, weight the events by their Monte Carlo weight.
+        else:
+            mc_weight = mc_weight[in_range]
+            counts += np.bincount(bin_indices, weights=mc_weight, minlength=num_bins)
+            sumw2 += np.bincount(bin_indices, weights=mc_weight**2, minlength=num_bins)
+
+    return {"counts": counts, "sumw2": sumw2}
+
+
+def read_subsample(sample: str, subsample: str, 
+                   cache_path: str) -> Iterator[tuple[np.ndarray, np.ndarray|None]]:
+    """
+    Reads and filters the data of a subsample for the Higgs to 4-Lepton decay 
+    process from the ATLAS Open Data project, yielding the valid events batch 
+    by batch. The valid events are also written to a Parquet cache file, which 
+    is only put in place once the whole subsample has been read.
+
+    Parameters
+    ----------
+    sample : str
+        The sample that the subsample belongs to.
+
+    subsample : str
+        The subsample (decay process) being processed.
+
+    cache_path : str
+        The path to the subsample's cache file.
+
+    Yields
+    ------
+    invariant_mass : numpy.ndarray
+        A NumPy array containing the invariant mass of each valid event in the 
+        batch.
+
+    mc_weight : numpy.ndarray | None
+        A NumPy array containing the Monte Carlo weight of each valid event in 
+        the batch. None for measured data.
+    """
+
+    # If the sample is measured data.
+    # Only the data variables are required (no weights).
+    if sample == "data":
+        prefix = "Data/"
+        variables = DATA_VARS
+
+    # If the sample is Monte Carlo data.
+    # The weight variables are also required.
+    else:
+        prefix = "MC/mc_" + str(infofile.infos[subsample]["DSID"]) + "."
+        variables = DATA_VARS + WEIGHT_VARS
+
+        # Calculate the cross section weight of the subsample.
+        cross_section_weight = calc_cross_section_weight(subsample)
+
+    # Create the path to the subsample.
+    path_subsample = PATH + prefix + subsample + ".4lep.root"
+
+    # Start the clock.
+    start_time = time.time()
+
+    # Open the subsample's file.
+    # Use the XRootD source, which requests the scattered baskets with vector reads.
+    tree = uproot.open({path_subsample: "mini"}, handler=uproot.source.xrootd.XRootDSource,
+                       array_cache=None)
+
+    # Write the cache to a temporary file, so a partially read subsample is never cached.
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_cache_path = cache_path + ".tmp"
+    cache_writer = None
+
+    try:
+        # Read the data in large steps so more baskets are coalesced per request.
+        events = tree.iterate(variables, library="ak", step_size="100 MB",
+                              entry_stop=(tree.num_entries * FRACTION),
+                              decompression_executor=DECOMPRESSION_EXECUTOR,
+                              interpretation_executor=INTERPRETATION_EXECUTOR)
+
+        # Filter the valid events in the data.
+        # The next batches are read in the background while the current batch is processed.
+        for data in prefetch(events, PREFETCH_SIZE):
+            # Store the number of events before reduction in the data.
+            num_events_before = len(data)
+
+            # Store the properties of the four leptons as regular (N, 4) NumPy arrays.
+            # Use the data types expected by the compiled kernel.
+            lepton_pt = to_lepton_array(data["lep_pt"], np.float32)
+            lepton_eta = to_lepton_array(data["lep_eta"], np.float32)
+            lepton_phi = to_lepton_array(data["lep_phi"], np.float32)
+            lepton_E = to_lepton_array(data["lep_E"], np.float32)
+            lepton_types = to_lepton_array(data["lep_type"], np.uint32)
+            lepton_charges = to_lepton_array(data["lep_charge"], np.int32)
+
+            # Keep the events with valid lepton type and charge.
+            # Calculate the invariant mass of the remaining events.
+            valid, invariant_mass = filter_mass(lepton_pt, lepton_eta, lepton_phi, lepton_E, 
+                                                lepton_types, lepton_charges)
+            invariant_mass = invariant_mass[valid] * MEV
+
+            # If the data is from Monte Carlo simulation, perform Monte Carlo specific processing.
+            if sample != "data":
+                # Calculate the Monte Carlo weights of the events.
+                # Calculate the final number of events.
+                mc_weight = calc_mc_weight(data[valid], cross_section_weight, WEIGHT_VARS)
+                num_events_after = mc_weight.sum()
+
+                # Store the valid events for the cache.
+                table = pyarrow.table({"mass": invariant_mass, "mc_weight": mc_weight})
+
+            # Otherwise, proceed as normal.
+            else:
+                # Calculate the final number of events.
+                mc_weight = None
+                num_events_after = len(invariant_mass)
+
+                # Store the valid events for the cache.
+                table = pyarrow.table({"mass": invariant_mass})
+
+            # Write the valid events to the cache.
+            if cache_writer is None:
+                cache_writer = pyarrow.parquet.ParquetWriter(temp_cache_path, table.schema, 
+                                                             compression="zstd")
+
+            cache_writer.write_table(table)
+
+            # Stop the timer.
+            # Print under the lock so the output of concurrent subsamples doesn't interleave.
+            runtime = time.time() - start_time
+            with PRINT_LOCK:
+                print(f"{sample} - {subsample}:" +
+                      f"\t Events Before: {num_events_before}" + 
                       f"\t Events After: {num_events_after:.3f}" +
                       f"\t Runtime: {runtime:.3f}")
 
-                # Save the current batch of data to the valid events list.
-                valid_events.append(data)
+            yield invariant_mass, mc_weight
 
-            # Save the subsample's processed data.
-            sample_processed_data.append(ak.concatenate(valid_events))
-        
-        # Save the sample's processed data.
-        processed_data[sample] = ak.concatenate(sample_processed_data)
+    finally:
+        # Close the cache file.
+        if cache_writer is not None:
+            cache_writer.close()
 
-    # Plot the processed data (saved as a png).
-    plot_data(processed_data)
+    # The whole subsample has been read, put the cache file in place.
+    if cache_writer is not None:
+        os.replace(temp_cache_path, cache_path)
 
 
-def valid_lepton_type(lepton_types: ak.Array) -> ak.Array:
+def read_cache(sample: str, subsample: str, 
+               cache_path: str) -> Iterator[tuple[np.ndarray, np.ndarray|None]]:
     """
-    Determines whether an event has the correct lepton type for the Higgs decay 
-    process. The total lepton type of an event should be one of the following 
-    to be considered as valid.
-
-    + 44 : electron + electron + electron + electron
-    + 48 : electron + electron + muon + muon
-    + 52 : muon + muon + muon + muon
+    Reads the valid events of a subsample from its Parquet cache file, 
+    yielding them batch by batch. The file is memory mapped and the columns 
+    are converted to NumPy arrays without copying.
 
     Parameters
     ----------
-    lepton_types : awkward.Array
-        An awkward array containing the lepton types of the four leptons in 
-        each event.
-    
-    Returns
-    -------
-    valid : awkward.Array
-        An awkward array containing boolean values which are True if an event 
-        has a valid total lepton type and False otherwise.
+    sample : str
+        The sample that the subsample belongs to.
+
+    subsample : str
+        The subsample (decay process) being processed.
+
+    cache_path : str
+        The path to the subsample's cache file.
+
+    Yields
+    ------
+    invariant_mass : numpy.ndarray
+        A NumPy array containing the invariant mass of each valid event in the 
+        batch.
+
+    mc_weight : numpy.ndarray | None
+        A NumPy array containing the Monte Carlo weight of each valid event in 
+        the batch. None for measured data.
     """
 
-    # Calculate the sum of the lepton types.
-    sum_lepton_types = lepton_types[:, 0] + lepton_types[:, 1] + lepton_types[:, 2] + lepton_types[:, 3]
+    # Print the subsample being read from the cache.
+    with PRINT_LOCK:
+        print(f"{sample} - {subsample}:\t Reading Cache: {cache_path}")
+
+    # Open the cache file.
+    cache_file = pyarrow.parquet.ParquetFile(cache_path, memory_map=True)
+
+    # Read the valid events in batches.
+    for batch in cache_file.iter_batches():
+        invariant_mass = batch.column("mass").to_numpy(zero_copy_only=True)
 
-    # Determine whether the total lepton type is valid.
-    valid = (sum_lepton_types == 44) | (sum_lepton_types == 48) | (sum_lepton_types == 52)
+        # Measured data has no Monte Carlo weights.
+        if sample != "data":
+            mc_weight = batch.column("mc_weight").to_numpy(zero_copy_only=True)
+        else:
+            mc_weight = None
 
-    return valid
+        yield invariant_mass, mc_weight
 
 
-def valid_lepton_charge(lepton_charges: ak.Array) -> ak.Array:
+def prefetch(iterable: Iterable, size: int) -> Iterator:
     """
-    Determines whether an event has the correct lepton charge for the Higgs 
-    decay process. The total lepton charge of an event should be 0 to be 
-    considered as valid.
+    Iterates over an iterable in a background thread, buffering up to a given 
+    number of items ahead of the consumer. This overlaps producing the items 
+    (e.g. reading data over the network) with consuming them. Any exception 
+    raised by the iterable is re-raised in the consumer.
 
     Parameters
     ----------
-    lepton_charges : awkward.Array
-        An awkward array containing the lepton charges of the four leptons in 
-        each event.
+    iterable : Iterable
+        The iterable to iterate over.
 
-    Returns
-    -------
-    valid : awkward.Array
-        An awkward array containing boolean values which are True if an event 
-        has a valid total lepton charge and False otherwise.
+    size : int
+        The maximum number of items buffered ahead of the consumer.
+
+    Yields
+    ------
+    item
+        The items of the iterable, in order.
     """
 
-    # Calculate the sum of the lepton charges.
-    sum_lepton_charges = lepton_charges[:, 0] + lepton_charges[:, 1] + lepton_charges[:, 2] + lepton_charges[:, 3]
+    # Create a bounded queue to buffer the items.
+    # Create a flag which is set once the consumer stops, so the producer stops too.
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    # Define a function which puts an entry in the queue, unless the consumer has stopped.
+    # The queue is retried with a timeout, so a stopped consumer is noticed while it is full.
+    def put(entry: tuple) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=PREFETCH_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    # Define the producer, which passes the items (then the end marker) through the queue.
+    # The producer returns early if the consumer stops, releasing the iterable.
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+
+            put((PREFETCH_END, None))
+
+        # Pass any exception to the consumer with the end marker.
+        except Exception as error:
+            put((PREFETCH_END, error))
 
-    # Determine whether the total lepton charge is valid.
-    valid = (sum_lepton_charges == 0)
+    # Start the producer in a background thread.
+    threading.Thread(target=produce, daemon=True).start()
 
-    return valid
+    # Yield the items until the end marker is reached.
+    # Stop the producer when the consumer stops (including stopping early due to an exception).
+    try:
+        while True:
+            item, error = items.get()
 
+            if item is PREFETCH_END:
+                if error is not None:
+                    raise error
 
-def calc_invariant_mass(lepton_pt: ak.Array, lepton_eta: ak.Array, 
-                        lepton_phi: ak.Array, lepton_E: ak.Array) -> ak.Array:
+                return
+
+            yield item
+
+    finally:
+        stop.set()
+
+
+def to_lepton_array(leptons: ak.Array, dtype: np.dtype) -> np.ndarray:
     """
-    Calculates the invariant mass of the four lepton state of an event in the 
-    Higgs decay process.
+    Converts a property of the four leptons in each event into a regular, 
+    C-contiguous (N, 4) NumPy array with the given data type. No copy is made 
+    if the data is already in this form.
 
     Parameters
     ----------
-    lepton_pt : awkward.Array
-        An awkward array containing the transverse momentums of the four 
-        leptons in each event.
-    
-    lepton_eta : awkward.Array
-        An awkward array containing the pseudorapidities of the four leptons in 
-        each event.
+    leptons : awkward.Array
+        An awkward array containing a property of the leptons in each event.
 
-    lepton_phi : awkward.Array
-        An awkward array containing the azimuthal angles of the four leptons in 
+    dtype : numpy.dtype
+        The data type of the NumPy array.
+
+    Returns
+    -------
+    lepton_array : numpy.ndarray
+        An (N, 4) NumPy array containing the property of the four leptons in 
         each event.
+    """
+
+    return np.ascontiguousarray(ak.to_numpy(leptons[:, :4]), dtype=dtype)
+
 
-    lepton_E : awkward.Array
-        An awkward array containing the energy of the four leptons in each 
-        event.
+def calc_cross_section_weight(subsample: str) -> float:
+    """
+    Calculates the cross section weight of a subsample. The cross section 
+    weight is the same for every event in the subsample.
+
+    Parameters
+    ----------
+    subsample : str
+        The subsample (decay process) being studied.
 
     Returns
     -------
-    invariant_mass : awkward.Array
-        An awkward array containing the invariant mass of the four lepton state 
-        of each event.
+    cross_section_weight : float
+        The cross section weight of the subsample.
     """
 
-    # Store the four lepton kinematic properties as an awkward array of vectors.
-    lepton_data = vector.zip({"pt": lepton_pt, "eta": lepton_eta, "phi": lepton_phi, "E": lepton_E})
+    # Get the information about the subsample being studied.
+    subsample_info = infofile.infos[subsample]
+
+    # Calculate the cross section weight.
+    numerator = LUMINOSITY * 1000 * subsample_info["xsec"]
+    denominator = subsample_info["red_eff"] * subsample_info["sumw"]
 
-    # Calculate the invariant mass.
-    invariant_mass = (lepton_data[:, 0] + lepton_data[:, 1] + lepton_data[:, 2] + lepton_data[:, 3]).M * MEV
+    cross_section_weight = numerator / denominator
 
-    return invariant_mass
+    return cross_section_weight
 
 
-def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) -> ak.Array:
+def calc_mc_weight(events: ak.Array, cross_section_weight: float, 
+                   weight_variables: list) -> np.ndarray:
     """
     Calculates the Monte Carlo weight of an event.
 
@@ -252,8 +514,8 @@ def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) ->
     events : ak.Array
         An awkward array containing the data from each event.
 
-    subsample : str
-        The subsample (decay process) being studied.
+    cross_section_weight : float
+        The cross section weight of the subsample being studied.
 
     weight_variables : list
         A list of the variables that contribute to the Monte Carlo weight of 
@@ -261,26 +523,17 @@ def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) ->
 
     Returns
     -------
-    mc_weight : ak.Array
-        An awkward array containing the Monte Carlo weight of each event.
+    mc_weight : np.ndarray
+        A NumPy array containing the Monte Carlo weight of each event.
     """
 
-    # Get the information about the subsample being studied.
-    subsample_info = infofile.infos[subsample]
-
-    # Calculate the cross section weight.
-    numerator = LUMINOSITY * 1000 * subsample_info["xsec"]
-    denominator = subsample_info["red_eff"] * subsample_info["sumw"]
-
-    cross_section_weight = numerator / denominator
-
-    # Create a variable to store the Monte Carlo weight.
-    mc_weight = cross_section_weight
+    # Create an array to store the Monte Carlo weight.
+    mc_weight = ak.to_numpy(events[weight_variables[0]]) * cross_section_weight
 
     # Calculate the Monte Carlo weight.
-    # Calculate the product of the weights.
-    for weight in weight_variables:
-        mc_weight = mc_weight * events[weight]
+    # Multiply in-place to avoid allocating an array for each weight.
+    for weight in weight_variables[1:]:
+        np.multiply(mc_weight, ak.to_numpy(events[weight]), out=mc_weight)
 
     return mc_weight
 
@@ -294,31 +547,28 @@ def plot_data(data: dict) -> None:
     Parameters
     ----------
     data : dict
-        A dictionary containing awkward arrays of the processed data for the 
-        Higgs to 4-Lepton decay process from the ATLAS Open Data project.
+        A dictionary containing the histogrammed data (bin counts and sums of 
+        squared weights) of each sample for the Higgs to 4-Lepton decay process 
+        from the ATLAS Open Data project.
     """
 
-    # Define the x-axis range of the plot.
-    x_min = 80 * GEV
-    x_max = 250 * GEV
-
     # Setup the histogram bins.
-    bin_width = 5 * GEV
-    bin_edges = np.arange(start=x_min, stop=(x_max+bin_width), step=bin_width)
-    bin_centres = np.arange(start=(x_min+(bin_width/2)), stop=(x_max+(bin_width/2)), step=bin_width)
+    bin_centres = np.arange(start=(X_MIN+(BIN_WIDTH/2)), stop=(X_MAX+(BIN_WIDTH/2)), step=BIN_WIDTH)
 
     # Setup the measured data for the histogram.
-    measured_data_binned, _ = np.histogram(ak.to_numpy(data["data"]["mass"]), bins=bin_edges)
+    measured_data_binned = data["data"]["counts"]
     measured_data_errors = np.sqrt(measured_data_binned)
 
     # Setup the Monte Carlo simulated signal data for the histogram.
-    mc_signal_data = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"]["mass"])
-    mc_signal_weights = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"].mc_weight)
+    # The binned data is plotted as one weighted entry per bin centre.
+    mc_signal_data = bin_centres
+    mc_signal_weights = data[r"Signal ($m_H$ = 125 GeV)"]["counts"]
     mc_signal_color = SAMPLES[r"Signal ($m_H$ = 125 GeV)"]["color"]
 
     # Setup the Monte Carlo simulated background data (multiple) for the histogram.
     mc_backgrounds_data = []
     mc_backgrounds_weights = []
+    mc_backgrounds_sumw2 = []
     mc_backgrounds_colors = []
     mc_backgrounds_labels = []
 
@@ -327,14 +577,14 @@ def plot_data(data: dict) -> None:
         # Exclude the non Monte Carlo simulated data.
         if sample not in ["data", r"Signal ($m_H$ = 125 GeV)"]:
             # Setup the Monte Carlo simulated background data for the histogram.
-            mc_backgrounds_data.append(ak.to_numpy(data[sample]["mass"]))
-            mc_backgrounds_weights.append(ak.to_numpy(data[sample].mc_weight))
+            mc_backgrounds_data.append(bin_centres)
+            mc_backgrounds_weights.append(data[sample]["counts"])
+            mc_backgrounds_sumw2.append(data[sample]["sumw2"])
             mc_backgrounds_colors.append(SAMPLES[sample]["color"])
             mc_backgrounds_labels.append(sample)
 
     # Calculate the errors.
-    mc_backgrounds_errors = np.sqrt(np.histogram(np.hstack(mc_backgrounds_data), bins=bin_edges, 
-                                                 weights=(np.hstack(mc_backgrounds_weights)**2))[0])
+    mc_backgrounds_errors = np.sqrt(np.sum(mc_backgrounds_sumw2, axis=0))
     
     # Create the main plot.
     fig, ax = plt.subplots()
@@ -344,7 +594,7 @@ def plot_data(data: dict) -> None:
 
     # Plot the Monte Carlo simulated background data.
     # Save the heights of the bars.
-    mc_backgrounds_heights = ax.hist(mc_backgrounds_data, bins=bin_edges, weights=mc_backgrounds_weights,
+    mc_backgrounds_heights = ax.hist(mc_backgrounds_data, bins=BIN_EDGES, weights=mc_backgrounds_weights,
                                      stacked=True, color=mc_backgrounds_colors, label=mc_backgrounds_labels)
     
     # Get the tallest heights of the bars.
@@ -352,14 +602,14 @@ def plot_data(data: dict) -> None:
 
     # Plot the statistical uncertainty in the Monte Carlo simulated background data.
     ax.bar(bin_centres, (2*mc_backgrounds_errors), bottom=(mc_backgrounds_tallest-mc_backgrounds_errors),
-           color="none", alpha=0.5, hatch="////", width=bin_width, label="Stat. Unc.")
+           color="none", alpha=0.5, hatch="////", width=BIN_WIDTH, label="Stat. Unc.")
 
     # Plot the Monte Carlo simulated signal data.
-    ax.hist(mc_signal_data, bins=bin_edges, bottom=mc_backgrounds_tallest, weights=mc_signal_weights, 
+    ax.hist(mc_signal_data, bins=BIN_EDGES, bottom=mc_backgrounds_tallest, weights=mc_signal_weights, 
             color=mc_signal_color, label=r"Signal ($m_H$ = 125 GeV)")
     
     # Set the x-axis and y-axis limits.
-    ax.set_xlim(left=x_min, right=x_max)
+    ax.set_xlim(left=X_MIN, right=X_MAX)
     ax.set_ylim(bottom=0, top=(np.amax(measured_data_binned)*1.6))
 
     # Set the x-axis and y-axis minor ticks.
@@ -373,7 +623,7 @@ def plot_data(data: dict) -> None:
     ax.set_xlabel(r"4-lepton invariant mass $\mathrm{m_{4l}}$ [GeV]", fontsize=13, x=1, horizontalalignment="right")
     
     # Set the y-axis label.
-    ax.set_ylabel(f"Events / {bin_width} GeV", y=1, horizontalalignment="right") 
+    ax.set_ylabel(f"Events / {BIN_WIDTH} GeV", y=1, horizontalalignment="right") 
 
     # Add "ATLAS Open Data" text.
     plt.text(0.05, 0.93, "ATLAS Open Data", transform=ax.transAxes, fontsize=13)
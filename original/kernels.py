@@ -0,0 +1,114 @@
+# Import external libraries.
+import numpy as np
+
+# Define the signature of the ahead-of-time compiled filter_mass kernel.
+FILTER_MASS_SIGNATURE = ("Tuple((b1[:], f8[:]))(f4[:, ::1], f4[:, ::1], f4[:, ::1], f4[:, ::1], "
+                         "u4[:, ::1], i4[:, ::1])")
+
+
+def filter_mass(lepton_pt: np.ndarray, lepton_eta: np.ndarray, lepton_phi: np.ndarray, 
+                lepton_E: np.ndarray, lepton_types: np.ndarray, 
+                lepton_charges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Determines whether events are valid for the Higgs decay process and 
+    calculates the invariant mass of the four lepton state of the valid events, 
+    in a single pass over the events. An event is considered as valid if its 
+    total lepton charge is 0 and its total lepton type is one of the following.
+
+    + 44 : electron + electron + electron + electron
+    + 48 : electron + electron + muon + muon
+    + 52 : muon + muon + muon + muon
+
+    The loops over the four leptons are unrolled, as each event always has 
+    exactly four leptons.
+
+    Parameters
+    ----------
+    lepton_pt : numpy.ndarray
+        An (N, 4) array containing the transverse momentums of the four 
+        leptons in each event (MeV).
+
+    lepton_eta : numpy.ndarray
+        An (N, 4) array containing the pseudorapidities of the four leptons in 
+        each event.
+
+    lepton_phi : numpy.ndarray
+        An (N, 4) array containing the azimuthal angles of the four leptons in 
+        each event.
+
+    lepton_E : numpy.ndarray
+        An (N, 4) array containing the energy of the four leptons in each 
+        event (MeV).
+
+    lepton_types : numpy.ndarray
+        An (N, 4) array containing the lepton types of the four leptons in 
+        each event.
+
+    lepton_charges : numpy.ndarray
+        An (N, 4) array containing the lepton charges of the four leptons in 
+        each event.
+
+    Returns
+    -------
+    valid : numpy.ndarray
+        An array containing boolean values which are True if an event is valid 
+        and False otherwise.
+
+    invariant_mass : numpy.ndarray
+        An array containing the invariant mass of the four lepton state of 
+        each event (MeV). The invariant mass is 0 for invalid events.
+    """
+
+    # Create arrays to store the validity and invariant mass of each event.
+    num_events = lepton_pt.shape[0]
+    valid = np.zeros(num_events, dtype=np.bool_)
+    invariant_mass = np.zeros(num_events, dtype=np.float64)
+
+    # Loop over the events.
+    for i in range(num_events):
+        # Calculate the sum of the lepton types and charges.
+        sum_lepton_types = (np.int64(lepton_types[i, 0]) + np.int64(lepton_types[i, 1]) + 
+                            np.int64(lepton_types[i, 2]) + np.int64(lepton_types[i, 3]))
+        sum_lepton_charges = (lepton_charges[i, 0] + lepton_charges[i, 1] + 
+                              lepton_charges[i, 2] + lepton_charges[i, 3])
+
+        # Skip the event if the total lepton type or charge is invalid.
+        if sum_lepton_types != 44 and sum_lepton_types != 48 and sum_lepton_types != 52:
+            continue
+
+        if sum_lepton_charges != 0:
+            continue
+
+        # Calculate the total momentum components and energy of the four lepton state.
+        px = (np.float64(lepton_pt[i, 0]) * np.cos(lepton_phi[i, 0]) + 
+              np.float64(lepton_pt[i, 1]) * np.cos(lepton_phi[i, 1]) + 
+              np.float64(lepton_pt[i, 2]) * np.cos(lepton_phi[i, 2]) + 
+              np.float64(lepton_pt[i, 3]) * np.cos(lepton_phi[i, 3]))
+        py = (np.float64(lepton_pt[i, 0]) * np.sin(lepton_phi[i, 0]) + 
+              np.float64(lepton_pt[i, 1]) * np.sin(lepton_phi[i, 1]) + 
+              np.float64(lepton_pt[i, 2]) * np.sin(lepton_phi[i, 2]) + 
+              np.float64(lepton_pt[i, 3]) * np.sin(lepton_phi[i, 3]))
+        pz = (np.float64(lepton_pt[i, 0]) * np.sinh(lepton_eta[i, 0]) + 
+              np.float64(lepton_pt[i, 1]) * np.sinh(lepton_eta[i, 1]) + 
+              np.float64(lepton_pt[i, 2]) * np.sinh(lepton_eta[i, 2]) + 
+              np.float64(lepton_pt[i, 3]) * np.sinh(lepton_eta[i, 3]))
+        E = (np.float64(lepton_E[i, 0]) + np.float64(lepton_E[i, 1]) + 
+             np.float64(lepton_E[i, 2]) + np.float64(lepton_E[i, 3]))
+
+        # Calculate the invariant mass.
+        # Clip at zero to guard against rounding errors.
+        valid[i] = True
+        invariant_mass[i] = np.sqrt(max(E**2 - px**2 - py**2 - pz**2, 0.0))
+
+    return valid, invariant_mass
+
+
+if __name__ == "__main__":
+    # Import the ahead-of-time compiler (only needed to build the module of kernels).
+    from numba.pycc import CC
+
+    # Create and build the ahead-of-time compiled module of kernels.
+    # Build it with "python kernels.py", which places "atlas_kernels" next to this file.
+    cc = CC("atlas_kernels")
+    cc.export("filter_mass", FILTER_MASS_SIGNATURE)(filter_mass)
+    cc.compile()
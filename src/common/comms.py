@@ -2,7 +2,9 @@
 import time
 
 # Import external libraries.
-import pickle
+import awkward as ak
+import msgpack
+import numpy as np
 import pika
 
 # Define the name of the RabbitMQ server.
@@ -12,6 +14,9 @@ RABBITMQ_SERVER = "rabbitmq"
 TASKS_QUEUE = "tasks"
 RESULTS_QUEUE = "results"
 
+# Define the content type of the messages.
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
 
 class DataBatch:
     """
@@ -20,7 +25,7 @@ class DataBatch:
 
     Attributes
     ----------
-    batch_id : str
+    batch_id : int
         The unique identifier of the batch.
 
     sample : str
@@ -49,7 +54,11 @@ class DataBatch:
         The processed data for the batch.
     """
 
-    def __init__(self, batch_id: str, sample: str, subsample: str, sample_type: str, path: str, 
+    # Store the attributes in slots rather than a per-instance dictionary.
+    __slots__ = ("batch_id", "sample", "subsample", "sample_type", "path", "fraction", 
+                 "start_index", "stop_index", "processed_data")
+
+    def __init__(self, batch_id: int, sample: str, subsample: str, sample_type: str, path: str, 
                  fraction: float, start_index: int, stop_index: int) -> None:
         """
         Initialises an instance of the DataBatch class. View the class 
@@ -57,7 +66,7 @@ class DataBatch:
 
         Parameters
         ----------
-        batch_id : str
+        batch_id : int
             The unique identifier of the batch.
         
         sample : str
@@ -121,6 +130,141 @@ class DataBatch:
                 f"Stop Index        : {self.stop_index}     \n" +
                 f"Processed Data    : {self.processed_data}")
 
+    def to_msgpack(self) -> bytes:
+        """
+        Serialises the batch into a compact msgpack array. The processed data 
+        is stored as its awkward form, length and raw buffers (msgpack binary), 
+        so the array data is not converted into Python objects.
+
+        Returns
+        -------
+        bytes
+            The msgpack serialised batch.
+        """
+
+        # If the batch has not been processed, it only contains primitive information.
+        if self.processed_data is None:
+            processed_data = None
+
+        # Otherwise, decompose the processed data into its form, length and raw buffers.
+        # The buffers are packed as bytes views, so they are not copied before packing.
+        else:
+            form, length, container = ak.to_buffers(self.processed_data)
+            processed_data = [form.to_json(), length, 
+                              {key: memoryview(buffer).cast("B") 
+                               for key, buffer in container.items()}]
+
+        return msgpack.packb([self.batch_id, self.sample, self.subsample, self.sample_type, 
+                              self.path, self.fraction, self.start_index, self.stop_index, 
+                              processed_data])
+
+    @classmethod
+    def from_msgpack(cls, body: bytes) -> "DataBatch":
+        """
+        De-serialises a batch created by to_msgpack into a DataBatch object. 
+        The processed data is rebuilt from its buffers without copying them.
+
+        Parameters
+        ----------
+        body : bytes
+            The msgpack serialised batch.
+
+        Returns
+        -------
+        batch : DataBatch
+            The de-serialised DataBatch object.
+        """
+
+        # De-serialise the batch's information.
+        *information, processed_data = msgpack.unpackb(body)
+        batch = cls(*information)
+
+        # If the batch has been processed, rebuild its processed data.
+        if processed_data is not None:
+            form, length, container = processed_data
+            batch.processed_data = ak.from_buffers(form, length, container)
+
+        return batch
+
+
+class BatchSet:
+    """
+    A class that represents a set of batches of data, for bulk operations. 
+    The bookkeeping fields of the batches are stored as parallel NumPy arrays 
+    (structure of arrays), so operations over all the batches are vectorised.
+
+    Attributes
+    ----------
+    batches : list[DataBatch]
+        The DataBatch objects in the set.
+
+    batch_ids : numpy.ndarray
+        A NumPy array containing the unique identifier of each batch.
+
+    samples : numpy.ndarray
+        A NumPy array containing the sample that each batch belongs to.
+
+    processed_data : list[ak.Array]
+        A list containing the processed data of each batch.
+    """
+
+    # Store the attributes in slots rather than a per-instance dictionary.
+    __slots__ = ("batches", "batch_ids", "samples", "processed_data")
+
+    def __init__(self, batches: list[DataBatch]) -> None:
+        """
+        Initialises an instance of the BatchSet class. View the class 
+        docstring for information about its attributes.
+
+        Parameters
+        ----------
+        batches : list[DataBatch]
+            A list of DataBatch objects which represent batches of data.
+        """
+
+        # Set the DataBatch objects.
+        self.batches = batches
+
+        # Set the unique identifiers and samples of the batches.
+        self.batch_ids = np.fromiter((batch.batch_id for batch in batches), dtype=np.int64, 
+                                     count=len(batches))
+        self.samples = np.array([batch.sample for batch in batches], dtype=object)
+
+        # Set the processed data of the batches.
+        self.processed_data = [batch.processed_data for batch in batches]
+
+    def __len__(self) -> int:
+        """
+        Returns the number of batches in the set.
+        """
+
+        return len(self.batches)
+
+
+def connection_parameters(hostname: str) -> pika.ConnectionParameters:
+    """
+    Creates the parameters used to connect to a RabbitMQ server. TCP 
+    keepalive is enabled so idle connections between batches are kept alive 
+    and dead peers are detected. Pika disables Nagle's algorithm 
+    (TCP_NODELAY) on its sockets, so small messages are sent immediately.
+
+    Parameters
+    ----------
+    hostname : str
+        The hostname of the RabbitMQ server.
+
+    Returns
+    -------
+    parameters : pika.ConnectionParameters
+        The parameters used to connect to the RabbitMQ server.
+    """
+
+    return pika.ConnectionParameters(host=hostname, heartbeat=60, blocked_connection_timeout=300, 
+                                     socket_timeout=10, 
+                                     tcp_options={"TCP_KEEPIDLE": 60, 
+                                                  "TCP_KEEPINTVL": 30, 
+                                                  "TCP_KEEPCNT": 3})
+
 
 def open_connection(hostname: str, retries: int, wait_time: float) -> pika.BlockingConnection|None:
     """
@@ -154,7 +298,7 @@ def open_connection(hostname: str, retries: int, wait_time: float) -> pika.Block
         # Attempt to open a connection to the RabbitMQ server.
         try:
             # If a connection can be established, return it.
-            connection = pika.BlockingConnection(pika.ConnectionParameters(hostname))
+            connection = pika.BlockingConnection(connection_parameters(hostname))
             return connection
 
         # If a connection cannot be established.
@@ -175,33 +319,34 @@ def open_connection(hostname: str, retries: int, wait_time: float) -> pika.Block
     return None            
 
 
-def send_data(batches: list[DataBatch], connection: pika.BlockingConnection, 
-              queue_name: str) -> None:
+def send_data(batches: list[DataBatch], channel: pika.channel.Channel, queue_name: str) -> None:
     """
     Sends batches of data to a RabbitMQ queue as individual messages. A list of 
     DataBatch objects are expected.
 
+    + Warning: The queue is expected to have been declared on the channel.
+
     Parameters
     ----------
     batches : list[DataBatch]
         A list of DataBatch objects which represent batches of data.
 
-    connection : pika.BlockingConnection
-        The connection to the RabbitMQ server.
+    channel : pika.channel.Channel
+        The channel to the RabbitMQ server. The channel is left open, so it 
+        can be reused across calls.
 
     queue_name : str
         The name of the RabbitMQ queue.
     """
-    
-    # Open a channel and declare the queue.
-    channel = connection.channel()
-    channel.queue_declare(queue_name)
-    
+
+    # Set the properties of the messages.
+    # Messages are transient (not written to disk by the server).
+    # Confirming them is left to the caller (e.g. the manager commits a transaction per chunk).
+    properties = pika.BasicProperties(content_type=MSGPACK_CONTENT_TYPE, 
+                                      delivery_mode=pika.DeliveryMode.Transient)
+
     # Send each batch of data.
     for batch in batches:
-        # Serialise the batch using pickle and send it to the queue.
-        pickled_batch = pickle.dumps(batch)
-        channel.basic_publish(exchange="", routing_key=queue_name, body=pickled_batch)
-
-    # Close the channel.
-    channel.close()
+        # Serialise the batch using msgpack and send it to the queue.
+        channel.basic_publish(exchange="", routing_key=queue_name, body=batch.to_msgpack(), 
+                              properties=properties)
@@ -1,5 +1,10 @@
+# Import standard libraries.
+import sys
+import types
+
 # Define the root path (URL) to the ATLAS dataset.
-PATH = "https://atlas-opendata.web.cern.ch/Legacy13TeV/4lep/"
+# Use XRootD, which supports vector reads of the scattered baskets.
+PATH = "root://eospublic.cern.ch//eos/opendata/atlas/OutreachDatasets/2020-01-22/4lep/"
 
 # Define the fraction of the full ATLAS dataset to process.
 FRACTION = 1.0
@@ -7,33 +12,40 @@ FRACTION = 1.0
 # Define the batch size of each data batch.
 BATCH_SIZE = 25000
 
+# Define whether to print information about each processed batch.
+VERBOSE = True
+
 # Define the samples to process from the ATLAS dataset.
 # Define the colours for plotting.
 SAMPLES = {
     # Measured data from the ATLAS experiment.
     "data": {
-        "list"  : ["data_A", "data_B", "data_C", "data_D"]
+        "list"  : ("data_A", "data_B", "data_C", "data_D")
     },
 
     # Monte Carlo simulated background noise from [Z -> e+ e-], [Z -> mu+ mu-], [t tbar -> l+ l-] processes.
     r"Background $Z,t\bar{t}$": {
-        "list"  : ["Zee", "Zmumu", "ttbar_lep"],
+        "list"  : ("Zee", "Zmumu", "ttbar_lep"),
         "color" : "#6b59d3" # Purple
     },
 
     # Monte Carlo simulated background noise from [Z Z* -> l+ l- l+ l-] process.
     r"Background $ZZ^*$": {
-        "list"  : ["llll"],
+        "list"  : ("llll",),
         "color" : "#ff0000" # Red
     },
 
     # Monte Carlo simulated signal from [H -> Z Z* -> l+ l- l+ l-] process.
     r"Signal ($m_H$ = 125 GeV)": {
-        "list"  : ["ggH125_ZZ4lep", "VBFH125_ZZ4lep", "WH125_ZZ4lep", "ZH125_ZZ4lep"],
+        "list"  : ("ggH125_ZZ4lep", "VBFH125_ZZ4lep", "WH125_ZZ4lep", "ZH125_ZZ4lep"),
         "color" : "#00cdff" # Light Blue
     }
 }
 
+# Make the samples (and the information of each sample) read-only.
+SAMPLES = types.MappingProxyType({sample: types.MappingProxyType(info) 
+                                  for sample, info in SAMPLES.items()})
+
 # Define the energies.
 MEV = 0.001
 GEV = 1.0
@@ -42,16 +54,18 @@ GEV = 1.0
 LUMINOSITY = 10
 
 # Define the variables used for processing data (keys).
-DATA_VARS = ["lep_pt", 
-             "lep_eta", 
-             "lep_phi", 
-             "lep_E", 
-             "lep_charge", 
-             "lep_type"]
+# The branch names are interned (read-only tuple).
+DATA_VARS = tuple(sys.intern(variable) for variable in ("lep_pt", 
+                                                        "lep_eta", 
+                                                        "lep_phi", 
+                                                        "lep_E", 
+                                                        "lep_charge", 
+                                                        "lep_type"))
 
 # Define the extra variables used for processing Monte Carlo data (keys).
-WEIGHT_VARS = ["mcWeight", 
-               "scaleFactor_PILEUP", 
-               "scaleFactor_ELE", 
-               "scaleFactor_MUON", 
-               "scaleFactor_LepTRIGGER"]
\ No newline at end of file
+# The branch names are interned (read-only tuple).
+WEIGHT_VARS = tuple(sys.intern(variable) for variable in ("mcWeight", 
+                                                          "scaleFactor_PILEUP", 
+                                                          "scaleFactor_ELE", 
+                                                          "scaleFactor_MUON", 
+                                                          "scaleFactor_LepTRIGGER"))
\ No newline at end of file
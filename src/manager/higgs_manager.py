@@ -1,14 +1,14 @@
 # Import standard libraries.
+import concurrent.futures
+import secrets
 import time
 import sys
-import uuid
 
 # Import external libraries.
 import awkward as ak
 import matplotlib.pyplot as plt
 from matplotlib.ticker import AutoMinorLocator
 import numpy as np
-import pickle
 import pika
 import uproot
 
@@ -17,6 +17,15 @@ import comms
 import config
 import infofile
 
+# Define the number of subsample data files whose meta-data is read concurrently.
+METADATA_WORKERS = 16
+
+# Define the number of batches sent to the workers per confirmed chunk.
+PUBLISH_CHUNK_SIZE = 256
+
+# Define the number of processed batches acknowledged at once.
+ACK_BATCH_SIZE = 32
+
 
 def main():
     """
@@ -38,14 +47,31 @@ def main():
     # Batch the data that needs to be processed.
     batches = data_batcher(config.SAMPLES, config.PATH, config.FRACTION, config.BATCH_SIZE)
 
+    # Order the batches from the most to least expensive to process.
+    # This starts the longest batches first, so no worker is left with a long batch at the end.
+    batches.sort(key=batch_cost, reverse=True)
+
     # Print the number of batches.
     print(f"status: number of batches - {len(batches)}")
 
-    # Send the batches of data to the workers.
-    comms.send_data(batches, connection, comms.TASKS_QUEUE)
+    # Open a channel and declare the tasks queue.
+    channel = connection.channel()
+    channel.queue_declare(comms.TASKS_QUEUE)
+
+    # Send the batches of data to the workers, in chunks.
+    # Each chunk is committed as a transaction, so the server confirms a whole chunk at once.
+    channel.tx_select()
+
+    for chunk_start in range(0, len(batches), PUBLISH_CHUNK_SIZE):
+        comms.send_data(batches[chunk_start:(chunk_start+PUBLISH_CHUNK_SIZE)], channel, 
+                        comms.TASKS_QUEUE)
+        channel.tx_commit()
+
+    channel.close()
 
     # Retrieve the processed batches of data from the workers.
-    processed_batches = retrieve_batches(connection, comms.RESULTS_QUEUE, len(batches), 
+    processed_batches = retrieve_batches(connection, comms.RESULTS_QUEUE, 
+                                         {batch.batch_id for batch in batches}, 
                                          wait_time=1, terminate_time=240)
     
     # Close the connection to the RabbitMQ server.
@@ -56,6 +82,10 @@ def main():
         print("error: failed to retrieve processed data")
         sys.exit(1)
     
+    # Store the sent and processed batches of data as sets (for bulk operations).
+    batches = comms.BatchSet(batches)
+    processed_batches = comms.BatchSet(processed_batches)
+
     # Check for missing batches of data.
     missing_data_batches = missing_batches(batches, processed_batches)
 
@@ -72,7 +102,7 @@ def main():
             print("warning: missing the following batches of data")
 
             # Print the information of each missing batch.
-            for batch in missing_batches:
+            for batch in missing_data_batches:
                 print(batch)
 
             # Print another warning.
@@ -128,8 +158,14 @@ def data_batcher(samples: dict, path: str, fraction: float,
         of data.
     """
 
-    # Create a list to store each batch of data.
+    # Create lists to store each batch of data and each subsample data file.
     batches = []
+    subsamples = []
+
+    # Generate a random base for the batch IDs of this run.
+    # Results left in the queue by previous runs then can't match the IDs of this run.
+    # The base leaves room below 2^63, so the IDs fit in a signed 64-bit integer.
+    batch_id_base = secrets.randbits(62)
 
     # Loop through each sample.
     for sample in samples:
@@ -147,41 +183,102 @@ def data_batcher(samples: dict, path: str, fraction: float,
                 sample_type = "monte-carlo"
                 prefix = "MC/mc_" + str(infofile.infos[subsample]["DSID"]) + "."
 
-            # Construct the path to the subsample data file.
+            # Construct the path to the subsample data file and store it.
             path_subsample = path + prefix + subsample + ".4lep.root"
+            subsamples.append((sample, subsample, sample_type, path_subsample))
+
+    # Read the number of events in every subsample data file concurrently.
+    # This overlaps the network round trips to the server.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        subsamples_num_events = list(executor.map(read_num_events, 
+                                                  [entry[3] for entry in subsamples]))
+
+    # Batch each subsample data file.
+    for (sample, subsample, sample_type, path_subsample), data_num_events in zip(
+            subsamples, subsamples_num_events):
+        # Calculate the number of events to process.
+        # Ensure the maximum number of events are not exceeded.
+        num_events = min(data_num_events, round(data_num_events * fraction))
+
+        # Calculate the start and stop indices of the batches with the given batch size.
+        # Calculate the batch fractions (fraction of total events being processed).
+        starts = np.arange(0, num_events, batch_size)
+        stops = np.minimum(starts + batch_size, num_events)
+        batch_fractions = (stops - starts) / num_events
+
+        # Generate a DataBatch object for each batch of the subsample data file.
+        # The batch IDs are consecutive integers from the run's random base.
+        batch_ids = range(batch_id_base + len(batches), batch_id_base + len(batches) + len(starts))
+        batches.extend([comms.DataBatch(batch_id, sample, subsample, sample_type, path_subsample, 
+                                        batch_fraction, start, stop) 
+                        for batch_id, start, stop, batch_fraction in zip(
+                            batch_ids, starts.tolist(), stops.tolist(), batch_fractions.tolist())])
 
-            # Open the meta-data of the subsample data file.
-            with uproot.open(path_subsample + ":mini") as tree:
-                # Get the number of events in the data.
-                data_num_events = tree.num_entries
+    return batches
 
-            # Calculate the number of events to process.
-            # Ensure the maximum number of events are not exceeded.
-            num_events = min(data_num_events, round(data_num_events * fraction))
 
-            # Batch the subsample data file into batches with the given batch size.
-            # Generate a DataBatch object for each batch of the subsample data file.
-            for start in range(0, num_events, batch_size):
-                # Calculate the stop-index.
-                # Calculate the batch fraction (fraction of total events being processed).
-                stop = min(start + batch_size, num_events)
-                batch_fraction = (stop - start) / num_events
+def read_num_events(path_subsample: str) -> int:
+    """
+    Reads the number of events in a subsample data file, from its meta-data.
 
-                # Generate a DataBatch object for the batch of the subsample data file.
-                batches.append(comms.DataBatch(str(uuid.uuid4()), sample, subsample, sample_type, 
-                                               path_subsample, batch_fraction, start, stop))
+    Parameters
+    ----------
+    path_subsample : str
+        The path (URL) to the subsample data file.
 
-    return batches
+    Returns
+    -------
+    num_events : int
+        The number of events in the subsample data file.
+    """
 
+    # Open the meta-data of the subsample data file (using the XRootD source).
+    with uproot.open(path_subsample + ":mini", 
+                     handler=uproot.source.xrootd.XRootDSource) as tree:
+        # Get the number of events in the data.
+        num_events = tree.num_entries
 
-def group_batches(batches: list[comms.DataBatch], samples: dict) -> dict[str, ak.Array]:
+    return num_events
+
+
+def batch_cost(batch: comms.DataBatch) -> int:
+    """
+    Estimates the cost of processing a batch of data, as the number of values 
+    read. Monte Carlo batches read the weight variables in addition to the 
+    data variables.
+
+    Parameters
+    ----------
+    batch : comms.DataBatch
+        A DataBatch object containing the information about the batch of data.
+
+    Returns
+    -------
+    cost : int
+        The estimated cost of processing the batch of data.
+    """
+
+    # Get the number of variables read for the batch.
+    if batch.sample_type == "measured":
+        num_variables = len(config.DATA_VARS)
+
+    else:
+        num_variables = len(config.DATA_VARS) + len(config.WEIGHT_VARS)
+
+    # Calculate the cost.
+    cost = (batch.stop_index - batch.start_index) * num_variables
+
+    return cost
+
+
+def group_batches(batches: comms.BatchSet, samples: dict) -> dict[str, ak.Array]:
     """
     Groups batches of processed data based on the sample each batch belongs to.
 
     Parameters
     ----------
-    batches: list[communication.DataBatch]
-        A list of DataBatch objects which have their "processed_data" attribute 
+    batches: comms.BatchSet
+        A set of DataBatch objects which have their "processed_data" attribute 
         filled with an awkward array of processed data.
     
     samples : dict
@@ -199,23 +296,23 @@ def group_batches(batches: list[comms.DataBatch], samples: dict) -> dict[str, ak
 
     # Loop through each sample.
     for sample in samples:
-        # Create a list to store the batches of data for the sample.
-        samples_data[sample] = []
+        # Get the processed data of the batches which correspond to the sample.
+        sample_batches = [batches.processed_data[i] 
+                          for i in np.flatnonzero(batches.samples == sample)]
 
-        # Loop through each batch of data.
-        for batch in batches:
-            # If the the batch corresponds to the sample, store its processed data.
-            if batch.sample == sample:
-                samples_data[sample].append(batch.processed_data)
+        # If the sample has a single batch, use its data as is (avoids a copy).
+        if len(sample_batches) == 1:
+            samples_data[sample] = sample_batches[0]
 
-        # Combine the batches of data for the sample into an awkward array.
-        samples_data[sample] = ak.concatenate(samples_data[sample])
+        # Otherwise, combine the batches of data for the sample into an awkward array.
+        else:
+            samples_data[sample] = ak.concatenate(sample_batches, axis=0, mergebool=False)
     
     return samples_data
 
 
-def missing_batches(expected_batches: list[comms.DataBatch], 
-                    retrieved_batches: list[comms.DataBatch]) -> list[comms.DataBatch]|None:
+def missing_batches(expected_batches: comms.BatchSet, 
+                    retrieved_batches: comms.BatchSet) -> list[comms.DataBatch]|None:
     """
     Checks for missing batches of processed data through cross checking batch 
     ID's between sent and retrieved DataBatch objects. The function returns the 
@@ -224,11 +321,11 @@ def missing_batches(expected_batches: list[comms.DataBatch],
 
     Parameters
     ----------
-    expected_batches : list[comms.DataBatch]
-        A list of the expected DataBatch objects.
+    expected_batches : comms.BatchSet
+        A set of the expected DataBatch objects.
 
-    retrieved_batches : list[comms.DataBatch]
-        A list of the retrieved DataBatch objects.
+    retrieved_batches : comms.BatchSet
+        A set of the retrieved DataBatch objects.
 
     Returns
     -------
@@ -237,31 +334,27 @@ def missing_batches(expected_batches: list[comms.DataBatch],
         objects. Otherwise, None is returned. 
     """
 
-    # Create a dict which maps expected batch IDs to the corresponding DataBatch object.
-    expected_batches_map = {batch.batch_id: batch for batch in expected_batches}
-
-    # Create a set of retrieved batch IDs.
-    retrieved_batch_ids = {batch.batch_id for batch in retrieved_batches}
+    # Determine which expected batches' IDs were not retrieved.
+    missing = np.isin(expected_batches.batch_ids, retrieved_batches.batch_ids, invert=True)
 
-    # Get the missing batch IDs.
-    missing_batch_ids = set(expected_batches_map.keys()) - retrieved_batch_ids
-
-    # If there are no missing batches, return None.
-    if len(missing_batch_ids) == 0:
+    # If there are no missing batches, return None (without collecting any batches).
+    if not missing.any():
         return None
 
     # Create a list of the missing batches.
-    missing_batches = [expected_batches_map[batch_id] for batch_id in missing_batch_ids]
+    missing_batches = [expected_batches.batches[i] for i in np.flatnonzero(missing)]
 
     return missing_batches
 
 
-def retrieve_batches(connection: pika.BlockingConnection, queue_name: str, num_batches: int, 
+def retrieve_batches(connection: pika.BlockingConnection, queue_name: str, batch_ids: set[int], 
                      wait_time: float, terminate_time: float) -> list[comms.DataBatch]:
     """
-    Retrieves batches of data from a RabbitMQ queue. The function polls the 
-    RabbitMQ queue at given intervals, until either the number of expected 
-    batches are retrieved or the termination time is reached.
+    Retrieves batches of data from a RabbitMQ queue. The function consumes 
+    from the RabbitMQ queue, so batches are delivered as soon as they are 
+    published, until either the expected batches are retrieved or the 
+    termination time is reached. Delivered batches which are not expected 
+    (e.g. left in the queue by a previous run) are acknowledged and discarded.
 
     Parameters
     ----------
@@ -271,14 +364,14 @@ def retrieve_batches(connection: pika.BlockingConnection, queue_name: str, num_b
     queue_name : str
         The name of the RabbitMQ queue.
 
-    num_batches : int
-        The number of expected batches.
+    batch_ids : set[int]
+        The IDs of the expected batches.
 
     wait_time : float
-        The amount of time to wait between polls (seconds).
+        The maximum amount of time to wait for deliveries at once (seconds).
 
     termination_time : float
-        The amount of time to poll before terminating.
+        The amount of time to consume before terminating.
 
     Returns
     -------
@@ -289,34 +382,61 @@ def retrieve_batches(connection: pika.BlockingConnection, queue_name: str, num_b
     # Start a timer.
     start = time.time()
 
-    # Create a list to store the batches.
+    # Create lists to store the delivery-tags and batches, and the expected batches.
+    # Create a set to store the IDs of the retrieved expected batches.
+    deliveries = []
     batches = []
+    retrieved_batch_ids = set()
+
+    # Store the number of acknowledged and checked deliveries.
+    num_acked = 0
+    num_checked = 0
 
     # Create a channel and declare the queue.
+    # Allow enough unacknowledged messages for the acknowledgements to be batched.
     channel = connection.channel()
     channel.queue_declare(queue_name)
+    channel.basic_qos(prefetch_count=(2 * ACK_BATCH_SIZE))
+
+    # Consume from the queue, de-serialising and storing each delivered message.
+    consumer_tag = channel.basic_consume(
+        queue_name, auto_ack=False, 
+        on_message_callback=lambda ch, method, properties, body: deliveries.append(
+            (method.delivery_tag, comms.DataBatch.from_msgpack(body))))
 
-    # Poll the RabbitMQ queue until given number of batches are retrieved.
+    # Process deliveries until the expected batches are retrieved.
     # This loop also terminates if the termination time is reached.
-    while len(batches) != num_batches:
-        # Poll the queue for a response.
-        response = channel.basic_get(queue_name, auto_ack=True)
-
-        # If a response was returned.
-        if response[0] is not None:
-            # De-serialise the message and store it.
-            batches.append(pickle.loads(response[2]))
-
-        # If the termination time has been reached.
-        if time.time() - start > terminate_time:
-            # Close the channel and return the retrieved batches.
-            channel.close()
-            return batches
-        
-        # Wait before the next poll.
-        time.sleep(wait_time)
-
-    # Close the channel.
+    while len(batches) < len(batch_ids):
+        # Calculate the remaining time.
+        remaining_time = terminate_time - (time.time() - start)
+
+        # If the termination time has been reached, stop consuming.
+        if remaining_time <= 0:
+            break
+
+        # Wait for deliveries (returning early once any are dispatched).
+        connection.process_data_events(time_limit=min(wait_time, remaining_time))
+
+        # Keep the newly delivered batches which are expected (discarding any others).
+        # Redelivered copies of an already retrieved batch are also discarded.
+        for _, batch in deliveries[num_checked:]:
+            if batch.batch_id in batch_ids and batch.batch_id not in retrieved_batch_ids:
+                batches.append(batch)
+                retrieved_batch_ids.add(batch.batch_id)
+
+        num_checked = len(deliveries)
+
+        # Acknowledge the stored batches in a single message, once enough have accumulated.
+        if len(deliveries) - num_acked >= ACK_BATCH_SIZE:
+            channel.basic_ack(deliveries[-1][0], multiple=True)
+            num_acked = len(deliveries)
+
+    # Acknowledge any remaining stored batches.
+    if len(deliveries) > num_acked:
+        channel.basic_ack(deliveries[-1][0], multiple=True)
+
+    # Stop consuming and close the channel.
+    channel.basic_cancel(consumer_tag)
     channel.close()
 
     return batches
@@ -347,12 +467,15 @@ def plot_data(data: dict[str, ak.Array], filename: str) -> None:
     bin_centres = np.arange(start=(x_min+(bin_width/2)), stop=(x_max+(bin_width/2)), step=bin_width)
 
     # Setup the measured data for the histogram.
-    measured_data_binned, _ = np.histogram(ak.to_numpy(data["data"]["mass"]), bins=bin_edges)
+    # The processed data is flat with no missing values, so the NumPy conversions don't copy.
+    measured_data_binned, _ = np.histogram(ak.to_numpy(data["data"]["mass"], allow_missing=False), 
+                                           bins=bin_edges)
     measured_data_errors = np.sqrt(measured_data_binned)
 
     # Setup the Monte Carlo simulated signal data for the histogram.
-    mc_signal_data = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"]["mass"])
-    mc_signal_weights = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"].mc_weight)
+    mc_signal_data = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"]["mass"], allow_missing=False)
+    mc_signal_weights = ak.to_numpy(data[r"Signal ($m_H$ = 125 GeV)"]["mc_weight"], 
+                                    allow_missing=False)
     mc_signal_color = config.SAMPLES[r"Signal ($m_H$ = 125 GeV)"]["color"]
 
     # Setup the Monte Carlo simulated background data (multiple) for the histogram.
@@ -366,14 +489,29 @@ def plot_data(data: dict[str, ak.Array], filename: str) -> None:
         # Exclude the non Monte Carlo simulated data.
         if sample not in ["data", r"Signal ($m_H$ = 125 GeV)"]:
             # Setup the Monte Carlo simulated background data for the histogram.
-            mc_backgrounds_data.append(ak.to_numpy(data[sample]["mass"]))
-            mc_backgrounds_weights.append(ak.to_numpy(data[sample].mc_weight))
+            mc_backgrounds_data.append(ak.to_numpy(data[sample]["mass"], allow_missing=False))
+            mc_backgrounds_weights.append(ak.to_numpy(data[sample]["mc_weight"], 
+                                                      allow_missing=False))
             mc_backgrounds_colors.append(config.SAMPLES[sample]["color"])
             mc_backgrounds_labels.append(sample)
 
+    # Combine the Monte Carlo simulated background data and squared weights into single arrays.
+    # The arrays are preallocated and filled in place (the weights are squared as they are copied).
+    num_backgrounds_events = sum(len(background_data) for background_data in mc_backgrounds_data)
+    all_backgrounds_data = np.empty(num_backgrounds_events, dtype=np.float32)
+    all_backgrounds_weights_squared = np.empty(num_backgrounds_events, dtype=np.float32)
+    offset = 0
+
+    for background_data, background_weights in zip(mc_backgrounds_data, mc_backgrounds_weights):
+        num_events = len(background_data)
+        all_backgrounds_data[offset:(offset+num_events)] = background_data
+        np.multiply(background_weights, background_weights, 
+                    out=all_backgrounds_weights_squared[offset:(offset+num_events)])
+        offset += num_events
+
     # Calculate the errors.
-    mc_backgrounds_errors = np.sqrt(np.histogram(np.hstack(mc_backgrounds_data), bins=bin_edges, 
-                                                 weights=(np.hstack(mc_backgrounds_weights)**2))[0])
+    mc_backgrounds_errors = np.sqrt(np.histogram(all_backgrounds_data, bins=bin_edges, 
+                                                 weights=all_backgrounds_weights_squared)[0])
     
     # Create the main plot.
     fig, ax = plt.subplots()
@@ -1,26 +1,47 @@
 # Import standard libraries.
+import atexit
+import collections
+import concurrent.futures
 import time
 import sys
 
 # Import external libraries.
 import awkward as ak
-import pika
-import pickle
+import numba
+import numpy as np
 import uproot
-import vector
 
 # Import local modules.
 import comms
 import config
 import infofile
 
+# Define a bitmask with the valid total lepton types (44, 48, 52) as set bits.
+VALID_LEPTON_TYPES_MASK = np.uint64((1 << 44) | (1 << 48) | (1 << 52))
+
+# Create thread pools for decompressing and interpreting the ROOT file baskets.
+# These are reused for every batch processed by the worker.
+DECOMPRESSION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+INTERPRETATION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+# Create a thread pool for reading the next batch of data while the current batch is processed.
+READ_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# Define the amount of time without deliveries before the worker terminates (seconds).
+IDLE_TIMEOUT = 60
+
+# Create an ordered dictionary to store the open data files (least recently used first).
+# Batches of the same subsample reuse the open file, rather than reconnecting to the server.
+OPEN_TREES = collections.OrderedDict()
+MAX_OPEN_TREES = 4
+
 
 def main():
     """
     Represents a worker node that processes batches of data received from a 
     manager node. The data should be data for the Higgs to 4-Lepton decay 
     process from the ATLAS Open Data project. The worker node terminates if 
-    there are no more messages left in the RabbitMQ queue.
+    no messages are delivered from the RabbitMQ queue for the idle timeout.
     """
 
     # Open a connection to the RabbitMQ server.
@@ -36,27 +57,47 @@ def main():
     channel = connection.channel()
     channel.queue_declare(comms.TASKS_QUEUE)
 
-    # Retrieve and process batches of data, until there are none left in the RabbitMQ queue.
+    # Open a channel and declare the results queue (reused for every processed batch).
+    results_channel = connection.channel()
+    results_channel.queue_declare(comms.RESULTS_QUEUE)
+
+    # Create a queue to store the delivered batches of data (alongside their reads).
+    deliveries = collections.deque()
+
+    # Consume from the tasks queue, with up to 2 unacknowledged batches of data at once.
+    # Each delivered batch starts being read in the background straight away.
+    channel.basic_qos(prefetch_count=2)
+    channel.basic_consume(
+        comms.TASKS_QUEUE, auto_ack=False, 
+        on_message_callback=lambda ch, method, properties, body: deliveries.append(
+            start_read(method.delivery_tag, comms.DataBatch.from_msgpack(body))))
+
+    # Store the time of the last activity.
+    last_activity = time.time()
+
+    # Process batches of data, until none are delivered for the idle timeout.
     while True:
-        # Attempt to retrieve a batch of data.
-        message_tag, batch = retrieve_batch(channel, comms.TASKS_QUEUE, retries=12, wait_time=5)
-
-        # If a batch was not retrieved.
-        if message_tag is None:
-            # Close the connection to the RabbitMQ queue and server.
-            channel.close()
-            connection.close()
-
-            # Print a message and end the program.
-            print("exiting: no tasks in queue")
-            sys.exit(0)
-        
+        # Dispatch any delivered batches of data.
+        # Only wait for a delivery if there are no batches of data to process.
+        connection.process_data_events(time_limit=(0 if deliveries else 1))
+
+        # If there are no batches of data to process.
+        if not deliveries:
+            # If the idle timeout has been reached, stop processing.
+            if time.time() - last_activity > IDLE_TIMEOUT:
+                break
+
+            continue
+
+        # Get the next batch of data.
+        message_tag, batch, events_future = deliveries.popleft()
+
         # Attempt to process the batch of data.
         try:
-            # Process the batch of data.
+            # Process the batch of data (once it has been read).
             # Send the processed batch back to the manager.
-            processed_batch = process_data(batch)
-            comms.send_data([processed_batch], connection, comms.RESULTS_QUEUE)
+            processed_batch = process_data(batch, events_future.result())
+            comms.send_data([processed_batch], results_channel, comms.RESULTS_QUEUE)
 
             # Acknowledge the message as processed to the RabbitMQ queue.
             channel.basic_ack(message_tag)
@@ -69,261 +110,336 @@ def main():
             # Don't acknowledge the message and requeue to the RabbitMQ queue.
             channel.basic_nack(message_tag, requeue=True)
 
+        # Update the time of the last activity.
+        last_activity = time.time()
 
-def retrieve_batch(channel: pika.channel.Channel, queue_name: str, retries: int, 
-                   wait_time: float) -> tuple[int, comms.DataBatch]|tuple[None, None]:
-    """
-    Retrieves a batch of data (1 message) from a RabbitMQ queue. The function 
-    attempts to retrieve a batch of data from the given queue, for a set number 
-    of retries in intervals. If a batch of data could not be retrieved, None is 
-    returned. The batch of data is expected to be a DataBatch object.
+    # Close the connection to the RabbitMQ queues and server.
+    channel.close()
+    results_channel.close()
+    connection.close()
+
+    # Print a message and end the program.
+    print("exiting: no tasks in queue")
+    sys.exit(0)
 
-    + Warning: This function does not auto-acknowledge messages.
+
+def start_read(message_tag: int, 
+               batch: comms.DataBatch) -> tuple[int, comms.DataBatch, concurrent.futures.Future]:
+    """
+    Starts reading a delivered batch of data in the background, so it is read 
+    while earlier batches are processed.
 
     Parameters
     ----------
-    channel : pika.channel.Channel
-        The channel to the RabbitMQ server.
-
-    queue_name : str
-        The name of the RabbitMQ queue.
+    message_tag : int
+        The delivery-tag of the message (for manual acknowledgement).
 
-    retries : 
-        The number of attempts at retrieving a batch of data.
-    
-    wait_time : float
-        The amount of time to wait between retries (seconds).
+    batch : comms.DataBatch
+        The DataBatch object from the message.
 
     Returns
     -------
-    tuple[int, comms.DataBatch] | tuple[None, None] 
-        If successful, a tuple containing the delivery-tag of the message and 
-        the DataBatch object from the message. Otherwise, a tuple of None is 
-        returned.
+    tuple[int, comms.DataBatch, concurrent.futures.Future]
+        A tuple containing the delivery-tag of the message, the DataBatch 
+        object and a future for the events read by read_data.
     """
 
-    # Store the number of attempts.
-    attempts = 0
-
-    # Attempt to retrieve a batch of data, for the given number of retries.
-    while attempts < retries:
-        # Poll the queue for a response.
-        response = channel.basic_get(queue_name, auto_ack=False)
-
-        # If a message was returned.
-        if response[0] is not None:
-            # De-serialise the message.
-            # Return both the method-frame (for manual acknowledgement) and the message.
-            return (response[0].delivery_tag, pickle.loads(response[2]))
-        
-        # Otherwise, increase the attempts counter.
-        # Wait before the next attempt.
-        attempts += 1
-        time.sleep(wait_time)
-
-    # If a batch of data was not retrieved, return None.
-    return (None, None)
+    return (message_tag, batch, READ_EXECUTOR.submit(read_data, batch))
 
 
-def process_data(batch: comms.DataBatch) -> comms.DataBatch:
+def read_data(batch: comms.DataBatch) -> ak.Array:
     """
-    Processes a batch of data for the Higgs to 4-Lepton decay process from the 
-    ATLAS Open Data project. A self-contained DataBatch is expected and also 
-    returned. 
+    Reads the events of a batch of data for the Higgs to 4-Lepton decay 
+    process from the ATLAS Open Data project. Only the variables required to 
+    process the batch are read.
 
     Parameters
     ----------
     batch : comms.DataBatch
         A DataBatch object containing the information about the batch of data 
-        to process.
+        to read.
 
     Returns
     -------
-    batch : comms.DataBatch
-        The passed DataObject with the "processed_data" attribute assigned with 
-        the processed data.
+    events : awkward.Array
+        An awkward array containing the data from each event in the batch.
     """
 
-    # Create a list to store valid events.
-    valid_events = []
-
-    # Print information about the batch of data.
-    print(f"Sample      : {batch.sample}\n" +
-          f"Subsample   : {batch.subsample}\n" +
-          f"Sample Type : {batch.sample_type}")
-
-    # Start a timer.
-    start = time.time()
-
-    # If the sample-type is "measured", set the corresponding iteration variables.
+    # If the sample-type is "measured", set the corresponding variables.
     if batch.sample_type == "measured":
-        iteration_vars = config.DATA_VARS
+        variables = config.DATA_VARS
 
-    # If the sample-type is "monte-carlo", set the corresponding iteration variables.
+    # If the sample-type is "monte-carlo", set the corresponding variables.
     else:
-        iteration_vars = config.DATA_VARS + config.WEIGHT_VARS
+        variables = config.DATA_VARS + config.WEIGHT_VARS
     
-    # Open the data file.
-    with uproot.open(batch.path + ":mini") as tree:
-        # Filter the valid events in the data.
-        for events in tree.iterate(iteration_vars, library="ak", step_size=config.BATCH_SIZE, 
-                                   entry_start=batch.start_index, entry_stop=batch.stop_index):
-            # Store the number of events before reducing the data.
-            num_events_before = len(events)
-
-            # Keep the events with valid lepton type.
-            lepton_types = events["lep_type"]
-            events = events[valid_lepton_type(lepton_types)]
-
-            # Keep the events with valid lepton charge.
-            lepton_charges = events["lep_charge"]
-            events = events[valid_lepton_charge(lepton_charges)]
-
-            # Calculate the invariant mass of the remaining events.
-            events["mass"] = calc_invariant_mass(events["lep_pt"], events["lep_eta"], 
-                                                 events["lep_phi"], events["lep_E"])
-
-            # If the sample-type is "monte-carlo", perform Monte Carlo specific processing.
-            if batch.sample_type == "monte-carlo":
-                # Calculate the Monte Carlo weights of the events.
-                # Calculate the final number of events.
-                events["mc_weight"] = calc_mc_weight(events, batch.subsample, config.WEIGHT_VARS)
-                num_events_after = sum(events["mc_weight"])
-
-            # Otherwise, proceed as normal.
-            else:
-                # Calculate the final number of events.
-                num_events_after = len(events)
-
-            # Stop the timer.
-            runtime = time.time() - start
-            print(f"\t Events Before: {num_events_before}" + 
-                  f"\t Events After: {num_events_after:.3f}" +
-                  f"\t Runtime: {runtime:.3f}")
-
-            # Store the valid events.
-            valid_events.append(events)
-    
-    # Store the processed data.
-    batch.processed_data = ak.concatenate(valid_events)
+    # Get the open data file.
+    # Read the whole batch at once.
+    tree = open_tree(batch.path)
+    events = tree.arrays(variables, library="ak", entry_start=batch.start_index, 
+                         entry_stop=batch.stop_index, 
+                         decompression_executor=DECOMPRESSION_EXECUTOR, 
+                         interpretation_executor=INTERPRETATION_EXECUTOR)
 
-    return batch
+    return events
 
 
-def valid_lepton_type(lepton_types: ak.Array) -> ak.Array:
+def open_tree(path: str) -> uproot.TTree:
     """
-    Determines whether events have the correct lepton type for the Higgs to 
-    4-Lepton decay process. The total lepton type of an event should be one of 
-    the following to be considered as valid.
-
-    + 44 : electron + electron + electron + electron
-    + 48 : electron + electron + muon + muon
-    + 52 : muon + muon + muon + muon
+    Opens the "mini" tree of a data file, reusing the open file if it has been 
+    opened recently. The least recently used file is closed once more than 
+    the maximum number of files are open.
 
     Parameters
     ----------
-    lepton_types : awkward.Array
-        An awkward array containing the lepton types of the four leptons in 
-        each event.
-    
+    path : str
+        The path (URL) to the data file.
+
     Returns
     -------
-    valid : awkward.Array
-        An awkward array containing boolean values which are True if an event 
-        has a valid total lepton type and False otherwise.
+    tree : uproot.TTree
+        The "mini" tree of the data file.
     """
 
-    # Calculate the sum of the lepton types.
-    sum_lepton_types = (lepton_types[:, 0] + lepton_types[:, 1] + lepton_types[:, 2] + 
-                        lepton_types[:, 3])
+    # If the data file is open, mark it as the most recently used and return it.
+    if path in OPEN_TREES:
+        OPEN_TREES.move_to_end(path)
+        return OPEN_TREES[path]
+
+    # Otherwise, open the data file (without caching arrays, as each branch is only read once).
+    # Use the XRootD source, which requests the scattered baskets with vector reads.
+    tree = uproot.open(path + ":mini", handler=uproot.source.xrootd.XRootDSource, 
+                       array_cache=None)
+    OPEN_TREES[path] = tree
+
+    # If too many data files are open, close the least recently used data file.
+    if len(OPEN_TREES) > MAX_OPEN_TREES:
+        _, closed_tree = OPEN_TREES.popitem(last=False)
+        closed_tree.file.close()
 
-    # Determine whether the total lepton type is valid.
-    valid = (sum_lepton_types == 44) | (sum_lepton_types == 48) | (sum_lepton_types == 52)
+    return tree
 
-    return valid
 
+@atexit.register
+def close_trees() -> None:
+    """
+    Closes all the open data files. This is called when the worker exits.
+    """
+
+    # Close each open data file.
+    while OPEN_TREES:
+        _, tree = OPEN_TREES.popitem()
+        tree.file.close()
 
-def valid_lepton_charge(lepton_charges: ak.Array) -> ak.Array:
+
+def process_data(batch: comms.DataBatch, events: ak.Array) -> comms.DataBatch:
     """
-    Determines whether events have the correct lepton charge for the Higgs to 
-    4-Lepton decay process. The total lepton charge of an event should be 0 to 
-    be considered as valid.
+    Processes a batch of data for the Higgs to 4-Lepton decay process from the 
+    ATLAS Open Data project. A self-contained DataBatch is expected and also 
+    returned. 
 
     Parameters
     ----------
-    lepton_charges : awkward.Array
-        An awkward array containing the lepton charges of the four leptons in 
-        each event.
+    batch : comms.DataBatch
+        A DataBatch object containing the information about the batch of data 
+        to process.
+
+    events : awkward.Array
+        An awkward array containing the data from each event in the batch, as 
+        read by read_data.
 
     Returns
     -------
-    valid : awkward.Array
-        An awkward array containing boolean values which are True if an event 
-        has a valid total lepton charge and False otherwise.
+    batch : comms.DataBatch
+        The passed DataObject with the "processed_data" attribute assigned with 
+        the processed data.
     """
 
-    # Calculate the sum of the lepton charges.
-    sum_lepton_charges = (lepton_charges[:, 0] + lepton_charges[:, 1] + lepton_charges[:, 2] + 
-                          lepton_charges[:, 3])
+    # Start a timer.
+    start = time.perf_counter()
+
+    # Store the number of events before reducing the data.
+    num_events_before = len(events)
+
+    # Convert the properties of the leptons into regular (N, 4) NumPy arrays.
+    lepton_pt = to_lepton_array(events["lep_pt"], np.float32)
+    lepton_eta = to_lepton_array(events["lep_eta"], np.float32)
+    lepton_phi = to_lepton_array(events["lep_phi"], np.float32)
+    lepton_E = to_lepton_array(events["lep_E"], np.float32)
+    lepton_types = to_lepton_array(events["lep_type"], np.uint32)
+    lepton_charges = to_lepton_array(events["lep_charge"], np.int32)
+
+    # Determine the valid events and calculate their invariant mass (a single pass).
+    valid, invariant_mass = filter_mass(lepton_pt, lepton_eta, lepton_phi, lepton_E, 
+                                        lepton_types, lepton_charges)
+
+    # Keep the invariant mass of the valid events.
+    processed_events = {"mass": invariant_mass[valid] * np.float32(config.MEV)}
+
+    # If the sample-type is "monte-carlo", calculate the Monte Carlo weights of the events.
+    if batch.sample_type == "monte-carlo":
+        processed_events["mc_weight"] = calc_mc_weight(events, valid, batch.subsample, 
+                                                       config.WEIGHT_VARS)
+
+    # If verbose, print information about the batch of data (in a single write).
+    if config.VERBOSE:
+        # If the sample-type is "monte-carlo", calculate the final (weighted) number of events.
+        if batch.sample_type == "monte-carlo":
+            num_events_after = float(processed_events["mc_weight"].sum())
+
+        # Otherwise, calculate the final number of events.
+        else:
+            num_events_after = len(processed_events["mass"])
+
+        # Stop the timer.
+        runtime = time.perf_counter() - start
+        sys.stdout.write(f"Sample      : {batch.sample}\n" +
+                         f"Subsample   : {batch.subsample}\n" +
+                         f"Sample Type : {batch.sample_type}\n" +
+                         f"\t Events Before: {num_events_before}" + 
+                         f"\t Events After: {num_events_after:.3f}" +
+                         f"\t Runtime: {runtime:.3f}\n")
+
+    # Store the processed data (only the processed quantities are kept).
+    batch.processed_data = ak.Array(processed_events)
 
-    # Determine whether the total lepton charge is valid.
-    valid = (sum_lepton_charges == 0)
+    return batch
 
-    return valid
 
+def to_lepton_array(leptons: ak.Array, dtype: np.dtype) -> np.ndarray:
+    """
+    Converts a property of the four leptons in each event into a regular 
+    (N, 4) NumPy array with the given data type. The jagged lepton lists are 
+    made regular once, so reductions over the leptons run on a plain NumPy 
+    array. No copy is made if the data already has the given data type.
 
-def calc_invariant_mass(lepton_pt: ak.Array, lepton_eta: ak.Array, lepton_phi: ak.Array, 
-                        lepton_E: ak.Array) -> ak.Array:
+    Parameters
+    ----------
+    leptons : awkward.Array
+        An awkward array containing a property of the leptons in each event.
+
+    dtype : numpy.dtype
+        The data type of the NumPy array.
+
+    Returns
+    -------
+    lepton_array : numpy.ndarray
+        An (N, 4) NumPy array containing the property of the four leptons in 
+        each event.
+    """
+
+    return np.asarray(ak.to_numpy(ak.to_regular(leptons[:, :4], axis=1)), dtype=dtype)
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def filter_mass(lepton_pt: np.ndarray, lepton_eta: np.ndarray, lepton_phi: np.ndarray, 
+                lepton_E: np.ndarray, lepton_types: np.ndarray, 
+                lepton_charges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """
-    Calculates each event's invariant mass of the four lepton state in the 
-    Higgs to 4-Lepton decay process.
+    Determines whether events are valid for the Higgs to 4-Lepton decay 
+    process and calculates the invariant mass of the four lepton state of the 
+    valid events, in a single (parallel) pass over the events. An event is 
+    considered as valid if its total lepton charge is 0 and its total lepton 
+    type is one of the following.
+
+    + 44 : electron + electron + electron + electron
+    + 48 : electron + electron + muon + muon
+    + 52 : muon + muon + muon + muon
 
     Parameters
     ----------
-    lepton_pt : awkward.Array
-        An awkward array containing the transverse momentums of the four 
+    lepton_pt : numpy.ndarray
+        An (N, 4) NumPy array containing the transverse momentums of the four 
         leptons in each event.
     
-    lepton_eta : awkward.Array
-        An awkward array containing the pseudorapidities of the four leptons in 
-        each event.
+    lepton_eta : numpy.ndarray
+        An (N, 4) NumPy array containing the pseudorapidities of the four 
+        leptons in each event.
+
+    lepton_phi : numpy.ndarray
+        An (N, 4) NumPy array containing the azimuthal angles of the four 
+        leptons in each event.
 
-    lepton_phi : awkward.Array
-        An awkward array containing the azimuthal angles of the four leptons in 
+    lepton_E : numpy.ndarray
+        An (N, 4) NumPy array containing the energy of the four leptons in 
         each event.
 
-    lepton_E : awkward.Array
-        An awkward array containing the energy of the four leptons in each 
-        event.
+    lepton_types : numpy.ndarray
+        An (N, 4) NumPy array containing the lepton types of the four leptons 
+        in each event.
+
+    lepton_charges : numpy.ndarray
+        An (N, 4) NumPy array containing the lepton charges of the four 
+        leptons in each event.
 
     Returns
     -------
-    invariant_mass : awkward.Array
-        An awkward array containing the invariant mass of the four lepton state 
-        of each event.
-    """
-
-    # Store the four lepton kinematic properties as an awkward array of vectors.
-    lepton_data = vector.zip({"pt": lepton_pt, "eta": lepton_eta, "phi": lepton_phi, 
-                              "E": lepton_E})
-
-    # Calculate the invariant mass.
-    invariant_mass = (lepton_data[:, 0] + lepton_data[:, 1] + lepton_data[:, 2] + 
-                      lepton_data[:, 3]).M * config.MEV
-
-    return invariant_mass
+    valid : numpy.ndarray
+        A NumPy array containing boolean values which are True if an event is 
+        valid and False otherwise.
 
+    invariant_mass : numpy.ndarray
+        A NumPy array containing the invariant mass of the four lepton state 
+        of each event. The invariant mass is 0 for invalid events.
+    """
 
-def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) -> ak.Array:
+    # Create arrays to store the validity and invariant mass of each event.
+    num_events = lepton_pt.shape[0]
+    valid = np.zeros(num_events, dtype=np.bool_)
+    invariant_mass = np.zeros(num_events, dtype=np.float32)
+
+    # Loop over the events in parallel.
+    for i in numba.prange(num_events):
+        # Calculate the sum of the lepton types and charges.
+        sum_lepton_types = (np.int64(lepton_types[i, 0]) + np.int64(lepton_types[i, 1]) + 
+                            np.int64(lepton_types[i, 2]) + np.int64(lepton_types[i, 3]))
+        sum_lepton_charges = (lepton_charges[i, 0] + lepton_charges[i, 1] + 
+                              lepton_charges[i, 2] + lepton_charges[i, 3])
+
+        # Skip the event if the total lepton type or charge is invalid.
+        # Test the total's bit in the mask, capping the shift at 63 (not a valid total).
+        shift = np.uint64(min(sum_lepton_types, 63))
+        if (VALID_LEPTON_TYPES_MASK >> shift) & np.uint64(1) == 0 or sum_lepton_charges != 0:
+            continue
+
+        # Get the properties of the event's four leptons.
+        pt0, pt1, pt2, pt3 = lepton_pt[i, 0], lepton_pt[i, 1], lepton_pt[i, 2], lepton_pt[i, 3]
+        eta0, eta1, eta2, eta3 = (lepton_eta[i, 0], lepton_eta[i, 1], lepton_eta[i, 2], 
+                                  lepton_eta[i, 3])
+        phi0, phi1, phi2, phi3 = (lepton_phi[i, 0], lepton_phi[i, 1], lepton_phi[i, 2], 
+                                  lepton_phi[i, 3])
+
+        # Calculate the total momentum components and energy of the four lepton state.
+        # The sums over the four leptons are written out in full (unrolled).
+        px = pt0*np.cos(phi0) + pt1*np.cos(phi1) + pt2*np.cos(phi2) + pt3*np.cos(phi3)
+        py = pt0*np.sin(phi0) + pt1*np.sin(phi1) + pt2*np.sin(phi2) + pt3*np.sin(phi3)
+        pz = pt0*np.sinh(eta0) + pt1*np.sinh(eta1) + pt2*np.sinh(eta2) + pt3*np.sinh(eta3)
+        E = lepton_E[i, 0] + lepton_E[i, 1] + lepton_E[i, 2] + lepton_E[i, 3]
+
+        # Calculate the invariant mass.
+        # Clip at zero to guard against rounding errors.
+        valid[i] = True
+        invariant_mass[i] = np.sqrt(max(E*E - px*px - py*py - pz*pz, 0.0))
+
+    return valid, invariant_mass
+
+
+def calc_mc_weight(events: ak.Array, valid: np.ndarray, subsample: str, 
+                   weight_variables: list) -> np.ndarray:
     """
-    Calculates the Monte Carlo weight of events in the Higgs to 4-lepton decay 
-    process.
+    Calculates the Monte Carlo weight of the valid events in the Higgs to 
+    4-lepton decay process. The events are selected on the flat NumPy weight 
+    columns, so the jagged lepton data in the events is not filtered.
 
     Parameters
     ----------
     events : ak.Array
         An awkward array containing the data from each event.
 
+    valid : numpy.ndarray
+        A NumPy array containing boolean values which are True if an event is 
+        valid and False otherwise.
+
     subsample : str
         The subsample (decay process) being studied.
 
@@ -333,8 +449,8 @@ def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) ->
 
     Returns
     -------
-    mc_weight : ak.Array
-        An awkward array containing the Monte Carlo weight of each event.
+    mc_weight : numpy.ndarray
+        A NumPy array containing the Monte Carlo weight of each valid event.
     """
 
     # Get the information about the subsample being studied.
@@ -346,13 +462,13 @@ def calc_mc_weight(events: ak.Array, subsample: str, weight_variables: list) ->
 
     cross_section_weight =  numerator / denominator
 
-    # Create a variable to store the Monte Carlo weight.
-    mc_weight = cross_section_weight
+    # Stack the weights of the valid events into a single precision (N, k) NumPy array.
+    weights = np.column_stack([ak.to_numpy(events[weight])[valid].astype(np.float32, copy=False) 
+                               for weight in weight_variables])
 
     # Calculate the Monte Carlo weight.
-    # Calculate the product of the weights.
-    for weight in weight_variables:
-        mc_weight = mc_weight * events[weight]
+    # Calculate the product of the weights (a single pass over the stacked weights).
+    mc_weight = weights.prod(axis=1) * np.float32(cross_section_weight)
 
     return mc_weight
 